@@ -1,17 +1,22 @@
+import asyncio
+import contextlib
 import csv
 import datetime
+import gzip
 import json
 import logging
+import multiprocessing
 import os
 import random
 import re
 import time
 import traceback
-from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Set, TextIO, Tuple, Union
 
-import requests
-from bs4 import BeautifulSoup
-from requests import RequestException, Timeout, TooManyRedirects
+import aiohttp
+from aiohttp_client_cache import CachedSession, SQLiteBackend
+from selectolax.lexbor import LexborHTMLParser
 
 error_logger = logging.getLogger('error_logger')
 error_logger.setLevel(logging.ERROR)
@@ -19,6 +24,19 @@ event_logger = logging.getLogger('event_logger')
 event_logger.setLevel(logging.DEBUG)
 
 CONFIG_PATH = 'config.json'
+# число штук в упаковке в названии товара, например "12 шт"
+QUANTITY_RE = re.compile(r'(\d{1,5})\s?(?:штук|шт)', re.IGNORECASE)
+# фасовка товара, например "2х500г", "3 кг", "800гр" или "10 литров"
+# единица измерения захватывается до конца слова, чтобы значение совпадало с написанием на сайте
+PACKING_RE = re.compile(r'(?:(?P<quantity>\d+)\s*х\s*)?(?P<value>\d[\d.,]*)\s*(?P<unit>кг|г|мл|л)\w*', re.IGNORECASE)
+# граммы и килограммы - это вес, литры и миллилитры - объем
+PACKING_UNIT_KINDS = {'г': 'weight', 'кг': 'weight', 'л': 'volume', 'мл': 'volume'}
+# кодировка в <meta charset="..."> или <meta http-equiv="Content-Type" content="...; charset=...">
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+# размер буфера записи, файл результатов весит мегабайты
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+# число товаров, которые копятся перед записью в файл результатов
+WRITE_BATCH_SIZE = 1024
 
 
 class ZootovaryParser:
@@ -33,8 +51,16 @@ class ZootovaryParser:
     log_event_file_name = 'event.log'
 
     def __init__(self):
-        self.results: List[dict] = list()
+        self._results_file: Optional[TextIO] = None
+        self._writer: Optional[csv.DictWriter] = None
+        self._pending: List[dict] = list()
+        # уже собранные пары (sku_article, sku_barcode) для быстрой проверки на повторы
+        self._seen: Set[Tuple[str, str]] = set()
         self.config = self.get_config()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self._run_timestamp: Optional[str] = None
 
     def _prepare_to_work(self):
         """
@@ -45,23 +71,17 @@ class ZootovaryParser:
         if not logs_dir:
             logs_dir = 'log'
             self.config['logs_dir'] = logs_dir
-        if not os.path.exists(logs_dir):
-            os.mkdir(logs_dir)
+        os.makedirs(logs_dir, exist_ok=True)
 
         output_directory = self.config.get('output_directory')
         if not output_directory:
             output_directory = 'out'
             self.config['output_directory'] = output_directory
-        if not os.path.exists(output_directory):
-            os.mkdir(output_directory)
+        os.makedirs(output_directory, exist_ok=True)
 
         self._setup_loggers()
 
-        max_retries = self.config.get('max_retries')
-        if not max_retries:
-            max_retries = 1
-            self.config['max_retries'] = max_retries
-            event_logger.info(f'set max_retries = {max_retries}')
+        self._prepare_session_config()
 
         restart = self.config.get('restart')
         if not restart:
@@ -72,6 +92,53 @@ class ZootovaryParser:
             self.config['restart'] = restart
             event_logger.info(f'set restart = {restart}')
 
+        self._open_results_file()
+
+    def _prepare_session_config(self):
+        """
+        Проверка настроек запросов и разбора страниц, вызывается и при отдельном вызове
+        parse_cats, get_items и get_item_data, когда _prepare_to_work не вызывалась
+        """
+        max_retries = self.config.get('max_retries')
+        if not max_retries:
+            max_retries = 1
+            self.config['max_retries'] = max_retries
+            event_logger.info(f'set max_retries = {max_retries}')
+
+        # максимальное число одновременных запросов к сайту
+        concurrency = self.config.get('concurrency')
+        if not concurrency:
+            concurrency = 8
+            self.config['concurrency'] = concurrency
+            event_logger.info(f'set concurrency = {concurrency}')
+
+        # число процессов для разбора страниц товаров, если не задано, то по числу ядер процессора
+        parse_workers = self.config.get('parse_workers')
+        if not parse_workers:
+            parse_workers = os.cpu_count()
+            self.config['parse_workers'] = parse_workers
+            event_logger.info(f'set parse_workers = {parse_workers}')
+
+        # время жизни кэша DNS, все запросы идут на один хост, поэтому адрес можно не запрашивать каждый раз
+        dns_cache_ttl_s = self.config.get('dns_cache_ttl_s')
+        if not dns_cache_ttl_s:
+            dns_cache_ttl_s = 300
+            self.config['dns_cache_ttl_s'] = dns_cache_ttl_s
+            event_logger.info(f'set dns_cache_ttl_s = {dns_cache_ttl_s}')
+
+        # кэш ответов на диске, при повторных запусках страницы берутся из него
+        # по умолчанию выключен, так как для товаров из кэша в файл попадут старые цены с новым временем сбора
+        cache = self.config.get('cache')
+        if not cache:
+            cache = {
+                "enabled": False,
+                "path": ".cache/zootovary",
+                "expire_after_s": 3600,
+                "refresh": False
+            }
+            self.config['cache'] = cache
+            event_logger.info(f'set cache = {cache}')
+
     def _log_error(self, message: str):
         """
         Функция логирования ошибок (как пример, в коде не используется)
@@ -138,39 +205,92 @@ class ZootovaryParser:
             file_name = f'results_{time.time_ns()}.csv'
         output_directory = self.config['output_directory']
         save_path = os.path.join(output_directory, file_name)
-        with open(save_path, 'w', encoding='utf-8', newline='') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames, delimiter=';')
+        with open(save_path, 'w', encoding='utf-8', newline='', buffering=WRITE_BUFFER_SIZE) as csv_file:
+            # лишние ключи (например, link у категорий) в файл не пишутся
+            writer = csv.DictWriter(csv_file, fieldnames=fieldnames, delimiter=';', extrasaction='ignore')
             writer.writeheader()
             writer.writerows(data)
 
-    def _get_source(self, url, params: dict = None, path: str = None) -> Optional[str]:
+    def _open_results_file(self):
+        """
+        Открытие файла результатов, товары записываются в него по мере сбора, а не хранятся в памяти
+        """
+        # время сбора цен одно на весь запуск парсинга
+        self._run_timestamp = datetime.datetime.now().isoformat(' ', 'seconds')
+        file_name = f'results_{time.time_ns()}.csv'
+        # сжатие gzip с минимальным уровнем: немного процессорного времени, но в разы меньше записи на диск
+        if self.config.get('compress_output'):
+            save_path = os.path.join(self.config['output_directory'], file_name + '.gz')
+            self._results_file = gzip.open(save_path, 'wt', compresslevel=1, encoding='utf-8', newline='')
+        else:
+            save_path = os.path.join(self.config['output_directory'], file_name)
+            self._results_file = open(save_path, 'w', encoding='utf-8', newline='', buffering=WRITE_BUFFER_SIZE)
+        self._writer = csv.DictWriter(self._results_file, fieldnames=self.main_fieldnames, delimiter=';')
+        self._writer.writeheader()
+
+    def _write_result(self, result: dict):
+        """
+        Добавление товара в очередь на запись, запись в файл идет пачками по WRITE_BATCH_SIZE товаров
+
+        :param result: данные товара
+        """
+        self._pending.append(result)
+        if len(self._pending) >= WRITE_BATCH_SIZE:
+            self._flush_results()
+
+    def _flush_results(self):
+        """
+        Запись накопленных товаров в файл результатов
+        """
+        self._writer.writerows(self._pending)
+        self._pending.clear()
+
+    def _close_results_file(self):
+        """
+        Запись оставшихся товаров и закрытие файла результатов
+        """
+        self._flush_results()
+        self._results_file.close()
+        self._results_file = None
+        self._writer = None
+
+    async def _get_source(self, url, params: dict = None) -> Optional[Union[bytes, str]]:
         """
         Функция получения html кода страницы
 
         :param url: ссылка для запроса
         :param params: параметры для запроса
-        :param path: путь для чтения файла с текстом ответа (используется для разработки)
-        :return: тест ответа в случаи успеха и None в другом случаи
-        """
-        event_logger.debug(f'GET URL: {url}')
-        if path:
-            with open(path, 'r', encoding='utf-8') as f:
-                source = f.read()
-            return source
-        max_retries = self.config.get('max_retries')
-        headers = self.config.get('headers')
+        :return: тело ответа в случаи успеха (байты для utf-8, иначе декодированная строка) и None в другом случаи
+        """
+        event_logger.debug('GET URL: %s', url)
+        max_retries = self.config['max_retries']
         while max_retries > 0:
             try:
-                response = requests.get(url, headers=headers, params=params)
-                event_logger.debug(f'RESPONSE URL: {response.url}')
-                if response.ok and response.status_code == 200:
-                    return response.text
+                async with self.session.get(url, params=params) as response:
+                    event_logger.debug('RESPONSE URL: %s', response.url)
+                    if response.ok and response.status == 200:
+                        # lexbor всегда читает байты как utf-8 и не смотрит на <meta charset>, поэтому напрямую
+                        # передаются только страницы, для которых в ответе явно указана кодировка utf-8,
+                        # остальные декодируются в строку, ошибочные байты заменяются
+                        charset = response.charset
+                        if charset and charset.lower() in ('utf-8', 'utf8'):
+                            return await response.read()
+                        if not charset:
+                            # кодировки нет в заголовке ответа, ищем ее в <meta charset> страницы
+                            search = META_CHARSET_RE.search(await response.read(), 0, 2048)
+                            if search:
+                                charset = search.group(1).decode('ascii')
+                        try:
+                            return await response.text(encoding=charset, errors='replace')
+                        except LookupError:
+                            # неизвестная кодировка
+                            return await response.text(errors='replace')
                 max_retries -= 1
-            except (RequestException, Timeout, TooManyRedirects, RequestException) as ex:
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
                 max_retries -= 1
                 error_logger.error(ex, exc_info=True)
 
-    def _make_delay(self):
+    async def _make_delay(self):
         """
         Функция для искусственной задержки
 
@@ -185,18 +305,89 @@ class ZootovaryParser:
         else:
             min_delay, max_delay = delay_range_s
         delay = random.uniform(min_delay, max_delay)
-        event_logger.debug(f'MAKE DELAY: {delay}')
-        time.sleep(delay)
+        event_logger.debug('MAKE DELAY: %s', delay)
+        await asyncio.sleep(delay)
+
+    @contextlib.asynccontextmanager
+    async def _session_scope(self, write_results: bool = False):
+        """
+        Открытие сессии, пула процессов для разбора и при необходимости файла результатов.
+        Если они уже открыты (например, при вызове из _start_parser), то используются текущие,
+        поэтому parse_cats, get_items и get_item_data можно вызывать и отдельно от start_parser
+
+        :param write_results: если True, то нужен файл результатов
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            if write_results and self._results_file is None:
+                self._open_results_file()
+                stack.callback(self._close_results_file)
+            if self.session is None:
+                await stack.enter_async_context(self._open_session())
+            yield
+
+    @contextlib.asynccontextmanager
+    async def _open_session(self):
+        """
+        Открытие сессии и пула процессов для разбора страниц товаров
+        """
+        self._prepare_session_config()
+        concurrency = self.config.get('concurrency')
+        # соединения переиспользуются (keep-alive) в пределах пула размером concurrency
+        connector = aiohttp.TCPConnector(
+            limit=concurrency, use_dns_cache=True, ttl_dns_cache=self.config.get('dns_cache_ttl_s')
+        )
+        timeout = aiohttp.ClientTimeout(sock_connect=3.05, sock_read=15)
+        # одна сессия на весь парсинг, количество одновременных запросов к товарам ограничивается семафором
+        # заголовки задаются один раз для сессии, а не при каждом запросе
+        cache_config = self.config.get('cache')
+        if cache_config.get('enabled'):
+            # GET ответы кэшируются в sqlite по url и параметрам запроса
+            cache = SQLiteBackend(
+                cache_config.get('path'), expire_after=cache_config.get('expire_after_s'), allowed_methods=('GET',)
+            )
+            session = CachedSession(
+                cache=cache, connector=connector, headers=self.config.get('headers'), timeout=timeout
+            )
+        else:
+            session = aiohttp.ClientSession(connector=connector, headers=self.config.get('headers'), timeout=timeout)
+        # страницы товаров разбираются в отдельных процессах, чтобы разбор не блокировал запросы
+        # процессы запускаются через spawn: они создаются уже внутри цикла событий, когда работают потоки asyncio,
+        # а fork многопоточного процесса может привести к зависанию
+        with ProcessPoolExecutor(
+                max_workers=self.config.get('parse_workers'), mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            async with session:
+                self.session = session
+                self.executor = executor
+                self.semaphore = asyncio.Semaphore(concurrency)
+                try:
+                    # в режиме обновления кэш не используется и все страницы запрашиваются заново
+                    if cache_config.get('enabled') and cache_config.get('refresh'):
+                        async with session.disabled():
+                            yield
+                    else:
+                        yield
+                finally:
+                    self.session = None
+                    self.executor = None
+                    self.semaphore = None
 
-    def _start_parser(self):
+    async def _start_parser(self):
         """
         Функция запуска парсинга
         """
+        async with self._session_scope():
+            await self._parse_categories()
+
+    async def _parse_categories(self):
+        """
+        Парсинг товаров по категориям
+        """
         categories = self.config.get('categories')
         # если нет категорий, то парсинг по всем категориям
         if not categories:
             # данные по категориям
-            categories = self.parse_cats()
+            categories = await self.parse_cats()
             for category in categories:
                 # парсинг идет только по подкатегориям, так как в основной категории могут быть не все товары
                 # и если парсить и главную и подкатегорию, то будет лишняя работа, так как товары будут повторяться
@@ -204,33 +395,36 @@ class ZootovaryParser:
                 # так как может быть, что есть основная категория, у которой нет подкатегорий
                 if category.get('parent_id'):
                     cat_url = self.domain + category.get('link')
-                    event_logger.debug(f'START CATEGORY: {cat_url}')
-                    self.get_items(cat_url)
+                    event_logger.debug('START CATEGORY: %s', cat_url)
+                    await self.get_items(cat_url)
         # иначе парсинг по каждой категории из файла конфигурации
         else:
             for category in categories:
                 # преобразования id категории в url
                 url = f'{self.domain}/catalog/{category}/'
-                event_logger.debug(f'START CATEGORY: {url}')
-                self.get_items(url)
-        # запись полученных данных в файл
-        self.write_csv(self.results, self.main_fieldnames)
+                event_logger.debug('START CATEGORY: %s', url)
+                await self.get_items(url)
 
     def _need_to_append_results(self, new_result: dict) -> bool:
         """
-        Проверка нужно ли добавлять товар в общий список
+        Проверка нужно ли добавлять товар в файл результатов
 
         :param new_result: полученные данные товара
         :return: True если надо добавлять, False если не надо
         """
-        # пробегается по всем собранным в процессе парсинга товарам и проверяет  на совпадение sku_article и sku_barcode
-        for result in self.results:
-            if result.get('sku_article') == new_result.get('sku_article') and new_result.get('sku_article') and \
-                    result.get('sku_barcode') == new_result.get('sku_barcode') and new_result.get('sku_barcode'):
-                return False
+        # проверяет, не встречалась ли уже пара sku_article и sku_barcode среди собранных товаров
+        sku_article = new_result.get('sku_article')
+        sku_barcode = new_result.get('sku_barcode')
+        # товары без артикула или штрихкода не проверяются
+        if not (sku_article and sku_barcode):
+            return True
+        key = (sku_article, sku_barcode)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
         return True
 
-    def parse_cats(self, write_csv=False) -> Optional[List[dict]]:
+    async def parse_cats(self, write_csv=False) -> Optional[List[dict]]:
         """
         Парисинг id категорий с главной страницы сайта
 
@@ -238,16 +432,17 @@ class ZootovaryParser:
         :return: список словарей с данными о категориях
         """
         cats_data = []
-        source = self._get_source(self.domain)
+        async with self._session_scope():
+            source = await self._get_source(self.domain)
         if not source:
             event_logger.warning(f'NO SOURCE IN: {self.domain}')
             return
-        soup = BeautifulSoup(source, 'lxml')
-        main_cats = soup.find('div', {'id': 'catalog-menu'}).find_all('li', {'class': 'lev1'})
+        tree = LexborHTMLParser(source)
+        main_cats = tree.css('div#catalog-menu li.lev1')
         for main_cat in main_cats:
-            main_cat_data = main_cat.find('a', {'class': 'catalog-menu-icon'})
-            main_cat_name = main_cat_data.find('span').getText(strip=True)
-            main_cat_link = main_cat_data.get('href')
+            main_cat_data = main_cat.css_first('a.catalog-menu-icon')
+            main_cat_name = main_cat_data.css_first('span').text(strip=True)
+            main_cat_link = main_cat_data.attributes.get('href')
             main_cat_id = main_cat_link.split('/catalog')[-1][1:-1]
             cats_data.append(
                 dict(
@@ -257,10 +452,10 @@ class ZootovaryParser:
                     link=main_cat_link
                 )
             )
-            sub_cats = main_cat.find('ul', {'class': 'catalog-cols'}).find_all('a')
+            sub_cats = main_cat.css_first('ul.catalog-cols').css('a')
             for sub_cat in sub_cats:
-                sub_cat_name = sub_cat.getText(strip=True)
-                sub_cat_link = sub_cat.get('href')
+                sub_cat_name = sub_cat.text(strip=True)
+                sub_cat_link = sub_cat.attributes.get('href')
                 sub_cat_id = sub_cat_link.split('/catalog')[-1][1:-1]
                 cats_data.append(
                     dict(
@@ -274,207 +469,114 @@ class ZootovaryParser:
             self.write_csv(cats_data, self.cats_fieldnames, file_name='categories.csv')
         return cats_data
 
-    def _extract_items(self, soup: BeautifulSoup):
+    async def _get_item_data_throttled(self, item_url: str):
         """
-        Функция сбора данных о товарах
+        Получение данных о товаре с ограничением числа одновременных запросов
 
-        :param soup: объект soup
+        :param item_url: ссылка на товар
         """
-        # поиск товаров
-        items = soup.find_all('div', {'class': 'catalog-item-top'})
-        for item in items:
-            link = item.find('a', {'class': 'name'}).get('href')
-            # ссылка на товар
-            item_url = self.domain + link
+        async with self.semaphore:
             # получение данных о товаре
-            self.get_item_data(item_url)
+            await self.get_item_data(item_url)
             # задержка
-            self._make_delay()
+            await self._make_delay()
 
-    def get_items(self, url: str):
+    async def _extract_items(self, tree: LexborHTMLParser):
         """
-        Общая функция сбора товаров из категории
-        (можно было реализовать немного иначе, но решил так)
+        Функция сбора данных о товарах
+
+        :param tree: разобранная html страница
+        """
+        # поиск ссылок на товары
+        items = tree.css('div.catalog-item-top a.name')
+        # сначала собираем ссылки на товары, затем получаем данные о товарах параллельно
+        domain = self.domain
+        item_urls = [domain + item.attributes.get('href') for item in items]
+        await asyncio.gather(*[self._get_item_data_throttled(item_url) for item_url in item_urls])
+
+    async def _get_page_items(self, url: str, page_number: int, last_page_number: int):
+        """
+        Сбор товаров с одной страницы категории
 
         :param url: ссылка на категорию
+        :param page_number: номер страницы
+        :param last_page_number: номер последней страницы
         """
-        source = self._get_source(url)
+        params = {
+            'PAGEN_1': page_number
+        }
+        event_logger.debug('GET NEXT PAGE: %s OF %s IN CATEGORY %s', page_number, last_page_number, url)
+        source = await self._get_source(url, params=params)
         if not source:
             event_logger.warning(f'NO SOURCE IN: {url}')
             return
-        soup = BeautifulSoup(source, 'lxml')
-        # получаем данные о товарах на первой странице
-        self._extract_items(soup)
-        # ищем последнюю страницу в навигации по страницам
-        try:
-            last_page_link = soup.find('div', {'class': 'navigation'}).find_all('a')[-1].get('href')
-        except AttributeError as e:
-            return
-        try:
-            last_page_number = int(last_page_link.split('PAGEN_1=')[-1])
-        except (ValueError, AttributeError) as e:
-            return
-        # итерация по страницам с товарами
-        for page_number in range(2, last_page_number + 1):
-            params = {
-                'PAGEN_1': page_number
-            }
-            event_logger.debug(f'GET NEXT PAGE: {page_number} OF {last_page_number} IN CATEGORY {url}')
-            source = self._get_source(url, params=params)
+        tree = LexborHTMLParser(source)
+        # получаем данные о товарах на странице с номером page_number
+        await self._extract_items(tree)
+
+    async def get_items(self, url: str):
+        """
+        Общая функция сбора товаров из категории
+        (можно было реализовать немного иначе, но решил так)
+
+        :param url: ссылка на категорию
+        """
+        # при отдельном вызове открываются сессия и файл результатов
+        async with self._session_scope(write_results=True):
+            source = await self._get_source(url)
             if not source:
                 event_logger.warning(f'NO SOURCE IN: {url}')
-                continue
-            soup = BeautifulSoup(source, 'lxml')
-            # получаем данные о товарах на странице с номером page_number
-            self._extract_items(soup)
+                return
+            tree = LexborHTMLParser(source)
+            # страница разбирается один раз: по ней ищутся и товары и последняя страница в навигации
+            last_page_number = self._find_last_page_number(tree)
+            # товары первой и остальных страниц обрабатываются параллельно
+            await asyncio.gather(
+                self._extract_items(tree),
+                *[self._get_page_items(url, page_number, last_page_number)
+                  for page_number in range(2, last_page_number + 1)]
+            )
 
-    def get_item_data(self, item_url: str):
+    @staticmethod
+    def _find_last_page_number(tree: LexborHTMLParser) -> int:
         """
-        Получение данных о товаре
+        Поиск номера последней страницы в навигации по страницам
 
-        :param item_url: ссылка на товар
+        :param tree: разобранная html страница
+        :return: номер последней страницы, 1 если навигации нет
         """
-        source = self._get_source(item_url)
-        if not source:
-            event_logger.warning(f'NO SOURCE IN: {item_url}')
-            return
-        soup = BeautifulSoup(source, 'lxml')
-        price_datetime = datetime.datetime.now()
         try:
-            sku_name = soup.find('h1').getText(strip=True)
-        except AttributeError:
-            sku_name = ''
-
-        # sku_quantity_min (штук в пачке) решил искать в названии с помощью регулярок
-        quantity_pattern = '\d{1,5}(\ )?(штук|шт)'
-        search = re.search(quantity_pattern, sku_name.lower())
-        if search:
-            try:
-                main_sku_quantity_min = search.group().replace('штук', '').replace('шт', '').strip()
-            except AttributeError:
-                main_sku_quantity_min = None
-        else:
-            main_sku_quantity_min = None
-        main_div = soup.find('div', {'class': 'catalog-element'})
-        if not main_div:
-            event_logger.warning(f'no main_div on {item_url}')
-            return
-        try:
-            sku_country = main_div.find(
-                'div', {'class': 'catalog-element-offer-left'}
-            ).find('p').getText(strip=True).split(':')[-1].strip()
-        except AttributeError:
-            sku_country = None
+            last_page_link = tree.css_first('div.navigation').css('a')[-1].attributes.get('href')
+        except (AttributeError, IndexError):
+            return 1
         try:
-            sku_categories = soup.find('ul', {'class': 'breadcrumb-navigation'}).find_all('li')
-            categories = []
-            for category in sku_categories:
-                if category.find('span'):
-                    continue
-                categories.append(category.getText(strip=True))
-            sku_category = '|'.join(categories)
-        except AttributeError:
-            sku_category = None
-
-        sku_link = item_url
-        try:
-            images = soup.find('div', {'class': 'catalog-element-pictures'}).find_all('a')
-            sku_images = ','.join([self.domain + image.get('href') for image in images])
-        except (AttributeError, TypeError):
-            sku_images = None
+            return int(last_page_link.split('PAGEN_1=')[-1])
+        except (ValueError, AttributeError):
+            return 1
 
-        # вариации товара (разный вес)
-        try:
-            offers = main_div.find('table', {'class': 'tg22 b-catalog-element-offers-table'}).find_all(
-                'tr', {'class': 'b-catalog-element-offer'}
-            )
-        except AttributeError:
-            offers = []
-        for offer in offers:
-            # вариация представлена как строка в таблице с колонками, в которых лежат необходимые данные
-            # шаблон товаров везде одинаковый и всегда есть определенное число колонок
-            columns = offer.find_all('td')
-            if not columns:
-                continue
-            try:
-                sku_article = columns[0].getText(strip=True).split(':')[-1]
-            except (IndexError, AttributeError):
-                sku_article = None
-            try:
-                # не самый хороший вариант искать элемент по стилям, но, считаю, здесь он более оптимальный
-                sku_barcode = columns[1].find('b', {'style': 'color:#c60505;'}).getText(strip=True)
-            except (IndexError, AttributeError):
-                sku_barcode = None
-            try:
-                # вес или объем фасовки товара
-                packing: str = columns[2].getText(strip=True).split(':')[-1]
-                # число в упаковке так же можно получить из фасовки
-                if packing.__contains__('х'):
-                    offer_sku_quantity_min = packing.split('х')[0]
-                    sku_quantity_min = offer_sku_quantity_min
-                else:
-                    sku_quantity_min = main_sku_quantity_min
-                # если в столбце с данными о фасовке есть "г" - граммы (кг или г), то это вес
-                if packing.__contains__('г'):
-                    sku_weight_min = packing.split('х')[-1]
-                    sku_volume_min = None
-                # если в столбце с данными о фасовке есть "л" - литры (мл или л), то это объем
-                elif packing.__contains__('л'):
-                    sku_volume_min = packing.split('х')[-1]
-                    sku_weight_min = None
-                else:
-                    sku_volume_min = None
-                    sku_weight_min = None
-            except (IndexError, AttributeError):
-                sku_weight_min = None
-                sku_volume_min = None
-                sku_quantity_min = main_sku_quantity_min
-
-            try:
-                # сначала получаем элемент, в котором лежат цены
-                price_element = columns[4].find('span')
-                if not price_element:
-                    price = None
-                    price_promo = None
-                else:
-                    # цену так же пришлось искать использую стили элементов
-                    if price_element.get('style').__contains__('color:#c60505'):
-                        price_promo = price_element.getText(strip=True)
-                        price = columns[4].find('s', {'style': 'color:#000000;'}).getText(strip=True)
-                    else:
-                        price = price_element.getText(strip=True)
-                        price_promo = None
-            except (IndexError, AttributeError):
-                price = None
-                price_promo = None
+    async def get_item_data(self, item_url: str):
+        """
+        Получение данных о товаре
 
-            # наличие товара проверяется по наличию кнопки покупки,
-            # так же можно проверять по наличию кнопки уведомления о поступлении
-            buy_button = columns[5].find('div', {'class': 'buybuttonarea'})
-            notify_button = columns[5].find('div', {'class': 'notavailbuybuttonarea'})
-            # товар в наличии, если есть кнопка покупки
-            sku_status = '1' if buy_button else '0'
-
-            res = dict(
-                price_datetime=price_datetime,
-                sku_name=sku_name,
-                sku_country=sku_country,
-                sku_link=sku_link,
-                sku_quantity_min=sku_quantity_min,
-                sku_images=sku_images,
-                sku_article=sku_article,
-                sku_barcode=sku_barcode,
-                sku_weight_min=sku_weight_min,
-                sku_volume_min=sku_volume_min,
-                price=price,
-                sku_category=sku_category,
-                price_promo=price_promo,
-                sku_status=sku_status
+        :param item_url: ссылка на товар
+        """
+        # при отдельном вызове открываются сессия и файл результатов
+        async with self._session_scope(write_results=True):
+            source = await self._get_source(item_url)
+            if not source:
+                event_logger.warning(f'NO SOURCE IN: {item_url}')
+                return
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, parse_item_data, source, item_url, self.domain, self._run_timestamp
             )
-            # проверка надо ли добавлять этот товар
-            # т.е. нет ли уже товара с таким же артикулом и шрихкодом
-            if self._need_to_append_results(res):
-                self.results.append(res)
+            if results is None:
+                event_logger.warning(f'no main_div on {item_url}')
+                return
+            for res in results:
+                # проверка надо ли добавлять этот товар
+                # т.е. нет ли уже товара с таким же артикулом и шрихкодом
+                if self._need_to_append_results(res):
+                    self._write_result(res)
 
     def start_parser(self):
         """
@@ -486,20 +588,159 @@ class ZootovaryParser:
         interval_m = restart.get('interval_m')
         interval_s = interval_m * 60
         event_logger.info('START PARSING')
-        for try_count in range(1, restart_count + 1):
-            try:
-                self._start_parser()
-                break
-            except Exception as e:
-                error_logger.error(f'MAIN ERROR {e}', exc_info=True)
-                if try_count == restart_count:
-                    event_logger.warning(f'BAD TRY {try_count}')
+        try:
+            for try_count in range(1, restart_count + 1):
+                try:
+                    asyncio.run(self._start_parser())
                     break
-                event_logger.warning(f'BAD TRY {try_count}, SLEEP {interval_m} m')
-                time.sleep(interval_s)
+                except Exception as e:
+                    error_logger.error(f'MAIN ERROR {e}', exc_info=True)
+                    if try_count == restart_count:
+                        event_logger.warning(f'BAD TRY {try_count}')
+                        break
+                    event_logger.warning(f'BAD TRY {try_count}, SLEEP {interval_m} m')
+                    time.sleep(interval_s)
+        finally:
+            self._close_results_file()
         event_logger.info('END PARSING')
 
 
+def parse_item_data(source: Union[bytes, str], item_url: str, domain: str, price_datetime: str) -> Optional[List[dict]]:
+    """
+    Разбор страницы товара, функция выполняется в отдельном процессе, поэтому не обращается к парсеру
+
+    :param source: html код страницы товара
+    :param item_url: ссылка на товар
+    :param domain: домен сайта для ссылок на изображения
+    :param price_datetime: время сбора цен
+    :return: список данных о вариациях товара, None если на странице нет данных о товаре
+    """
+    tree = LexborHTMLParser(source)
+    try:
+        sku_name = tree.css_first('h1').text(strip=True)
+    except AttributeError:
+        sku_name = ''
+
+    # sku_quantity_min (штук в пачке) решил искать в названии с помощью регулярок
+    search = QUANTITY_RE.search(sku_name)
+    main_sku_quantity_min = search.group(1) if search else None
+    main_div = tree.css_first('div.catalog-element')
+    if not main_div:
+        return None
+    try:
+        sku_country = main_div.css_first(
+            'div.catalog-element-offer-left'
+        ).css_first('p').text(strip=True).split(':')[-1].strip()
+    except AttributeError:
+        sku_country = None
+    try:
+        sku_categories = tree.css_first('ul.breadcrumb-navigation').css('li')
+        categories = []
+        for category in sku_categories:
+            if category.css_first('span'):
+                continue
+            categories.append(category.text(strip=True))
+        sku_category = '|'.join(categories)
+    except AttributeError:
+        sku_category = None
+
+    sku_link = item_url
+    try:
+        images = tree.css_first('div.catalog-element-pictures').css('a')
+        sku_images = ','.join(domain + image.attributes.get('href') for image in images)
+    except (AttributeError, TypeError):
+        sku_images = None
+
+    results = []
+    # вариации товара (разный вес)
+    try:
+        offers = main_div.css_first('table.tg22.b-catalog-element-offers-table').css(
+            'tr.b-catalog-element-offer'
+        )
+    except AttributeError:
+        offers = []
+    for offer in offers:
+        # вариация представлена как строка в таблице с колонками, в которых лежат необходимые данные
+        # шаблон товаров везде одинаковый и всегда есть определенное число колонок
+        columns = offer.css('td')
+        if not columns:
+            continue
+        try:
+            sku_article = columns[0].text(strip=True).split(':')[-1]
+        except (IndexError, AttributeError):
+            sku_article = None
+        try:
+            # не самый хороший вариант искать элемент по стилям, но, считаю, здесь он более оптимальный
+            sku_barcode = columns[1].css_first('b[style="color:#c60505;"]').text(strip=True)
+        except (IndexError, AttributeError):
+            sku_barcode = None
+        try:
+            # вес или объем фасовки товара
+            packing: str = columns[2].text(strip=True).split(':')[-1]
+            sku_weight_min = None
+            sku_volume_min = None
+            sku_quantity_min = main_sku_quantity_min
+            search = PACKING_RE.search(packing)
+            if search:
+                # число в упаковке так же можно получить из фасовки
+                if search.group('quantity'):
+                    sku_quantity_min = search.group('quantity')
+                # значение вместе с единицами измерения, например "500г" или "800гр"
+                packing_value = packing[search.start('value'):search.end()]
+                if PACKING_UNIT_KINDS[search.group('unit').lower()] == 'weight':
+                    sku_weight_min = packing_value
+                else:
+                    sku_volume_min = packing_value
+        except (IndexError, AttributeError):
+            sku_weight_min = None
+            sku_volume_min = None
+            sku_quantity_min = main_sku_quantity_min
+
+        try:
+            # сначала получаем элемент, в котором лежат цены
+            price_element = columns[4].css_first('span')
+            if not price_element:
+                price = None
+                price_promo = None
+            else:
+                # цену так же пришлось искать использую стили элементов
+                if price_element.attributes.get('style').__contains__('color:#c60505'):
+                    price_promo = price_element.text(strip=True)
+                    price = columns[4].css_first('s[style="color:#000000;"]').text(strip=True)
+                else:
+                    price = price_element.text(strip=True)
+                    price_promo = None
+        except (IndexError, AttributeError):
+            price = None
+            price_promo = None
+
+        # наличие товара проверяется по наличию кнопки покупки,
+        # так же можно проверять по наличию кнопки уведомления о поступлении
+        buy_button = columns[5].css_first('div.buybuttonarea')
+        notify_button = columns[5].css_first('div.notavailbuybuttonarea')
+        # товар в наличии, если есть кнопка покупки
+        sku_status = '1' if buy_button else '0'
+
+        res = dict(
+            price_datetime=price_datetime,
+            sku_name=sku_name,
+            sku_country=sku_country,
+            sku_link=sku_link,
+            sku_quantity_min=sku_quantity_min,
+            sku_images=sku_images,
+            sku_article=sku_article,
+            sku_barcode=sku_barcode,
+            sku_weight_min=sku_weight_min,
+            sku_volume_min=sku_volume_min,
+            price=price,
+            sku_category=sku_category,
+            price_promo=price_promo,
+            sku_status=sku_status
+        )
+        results.append(res)
+    return results
+
+
 def main():
     zootovary_parser = ZootovaryParser()
     zootovary_parser.start_parser()